@@ -51,7 +51,20 @@ gis = GIS(username='krganapa_UCSDOnline')
 # In[11]:
 
 
-public_content = gis.content.search("Bike San diego", item_type="Feature Layer", max_items=10, outside_org=True)
+# We will need two searches in this notebook: bike data (here), and Landsat imagery (later on).
+# Each search is a separate request to the portal. Instead of waiting for each answer in turn,
+# we can send both searches at the same time, from a small pool of threads:
+from concurrent.futures import ThreadPoolExecutor
+
+searches = {
+    'bike': dict(query="Bike San diego", item_type="Feature Layer", max_items=10, outside_org=True),
+    'landsat': dict(query='"Landsat"', item_type="Imagery Layer"),
+}
+with ThreadPoolExecutor(max_workers=len(searches)) as pool:
+    futures = {name: pool.submit(gis.content.search, **kwargs) for name, kwargs in searches.items()}
+    search_results = {name: future.result() for name, future in futures.items()}
+
+public_content = search_results['bike']
 
 # un-comment this to see other types of available data
 # public_content = gis.content.search("Bike San diego", max_items=20)
@@ -123,7 +136,8 @@ map1.basemap = 'hybrid'
 # In[18]:
 
 
-landsat_list = gis.content.search('"Landsat"', 'Imagery Layer')
+# this search was already sent together with the bike search, above
+landsat_list = search_results['landsat']
 
 
 # In[19]:
@@ -174,5 +188,33 @@ area
 # In[ ]:
 
 
+# geocode() sends one request per address. When you have many addresses, first remove the duplicates 
+# (after normalizing case and spaces), and then send the rest together, with batch_geocode.
+# We also keep the results in a dictionary, so an address that was already geocoded is never sent again:
+# batch geocoding consumes ArcGIS credits for every address.
+from arcgis.geocoding import batch_geocode, get_geocoders
+
+geocoded = {}
+
+# the geocoder rejects batches larger than its MaxBatchSize (typically 1000 addresses), so we send them in chunks
+batch_size = get_geocoders(gis)[0].properties.locatorProperties.MaxBatchSize
+
+def geocode_many(addresses):
+    normalized = [' '.join(a.lower().split()) for a in addresses]
+    new = sorted(set(normalized) - geocoded.keys())
+    for start in range(0, len(new), batch_size):
+        chunk = new[start:start + batch_size]
+        for address, result in zip(chunk, batch_geocode(chunk)):
+            # batch_geocode returns None for an address it could not find: we record it as None too,
+            # so that it is not sent again
+            geocoded[address] = result['location'] if result else None
+    return [geocoded[a] for a in normalized]
+
+geocode_many(['San Diego, CA', 'La Jolla, CA', 'san diego,  CA'])
+
+
+# In[ ]:
+
+
 
 
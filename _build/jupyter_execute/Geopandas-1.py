@@ -100,6 +100,20 @@ pop_places.plot()
 # colorado.to_file('zipcodes_colorado.shp') 
 
 
+# With hundreds of thousands of points, drawing each of them as a separate marker gets very slow. Instead, you can count the points that fall into each pixel of a grid, and show the grid as one image:
+# 
+# ```python
+# import numpy as np
+# import matplotlib.pyplot as plt
+# 
+# counts, xedges, yedges = np.histogram2d(pop_places.geometry.x, pop_places.geometry.y, 
+#                                         bins=(720, 360), range=[[-180, 180], [-90, 90]])
+# plt.figure(figsize=(10,5))
+# plt.imshow(np.log1p(counts.T), origin='lower', extent=[-180, 180, -90, 90], cmap='viridis')
+# ```
+# 
+# `histogram2d` also takes `weights=`, eg `weights=pop_places['pop_max']` to sum an attribute per pixel. For really large layers, compute the grid for chunks of points and add the grids up.
+
 # GeoJSON uses the same set of graphic primitives, and a similar encoding: see https://en.wikipedia.org/wiki/GeoJSON and http://geojson.org. 
 # 
 # You experimented with GeoJSON in DSC80. Good sources of geojson files are: 
@@ -189,6 +203,20 @@ south_colorado = colorado.cx[:,:4200000]
 
 south_colorado.plot(figsize=(10,10))
 
+# cx filters the records after the whole file has been read. If you only need the southern part, 
+# you can pass the bounding box to read_file instead: the shapefile index (.shx, and .qix if present)
+# is used to skip the records outside of it, so they are never decoded.
+# The bbox is (minx, miny, maxx, maxy) - we get the full extent of the layer from the file header.
+
+import fiona
+with fiona.open(shpFileIn) as src:
+    minx, miny, maxx, maxy = src.bounds
+
+south_colorado = geopandas.read_file(shpFileIn, bbox=(minx, miny, maxx, 4200000))
+
+# similarly, attribute filters and column selection can be done while reading (requires the pyogrio engine):
+# big_zips = geopandas.read_file(shpFileIn, engine='pyogrio', where='SHAPE_Area > 5000000000', columns=['NAME', 'SHAPE_Area'])
+
 
 # 
 # New Term: **Bounding Box** (BBOX), also "minimum bounding rectangle (MBR)", "envelope": max extent of a 2D object in a given projection. Defined by minx, maxx, miny, maxy.
@@ -244,6 +272,16 @@ colorado.plot(column='SHAPE_Area', cmap='OrRd', scheme ='fisher_jenks', k=5)
 colorado.plot(column='SHAPE_Area', cmap='OrRd', scheme ='quantiles', k=5)
 
 
+# Each `plot(..., scheme=...)` call above computes the class breaks from scratch, and Fisher-Jenks gets slow on large data (its cost grows with the square of the number of values). To draw the same classes several times, eg with different color maps, compute the breaks once and pass them to each plot with `scheme='user_defined'`:
+# 
+# ```python
+# fj = mapclassify.FisherJenks(colorado['SHAPE_Area'], k=5)
+# colorado.plot(column='SHAPE_Area', cmap='OrRd', scheme='user_defined', classification_kwds={'bins': fj.bins})
+# colorado.plot(column='SHAPE_Area', cmap='Blues', scheme='user_defined', classification_kwds={'bins': fj.bins})
+# ```
+# 
+# (`mapclassify.FisherJenksSampled` is faster on very large columns, since it only classifies a random sample of the values - but then the breaks change every time you run it.)
+
 # In[18]:
 
 
@@ -391,6 +429,26 @@ world2 = merged_df.plot(column = 'Unemployment rate (%)', cmap='OrRd', figsize=(
 # fig.savefig("output.png", dpi=300)
 
 
+# A cleaner way to load this sheet: its column names are in the second row, so you can tell `read_excel` to use that row as the header (`header=1`). Then pandas detects the numeric columns itself, instead of storing every value as text - and the missing values can be filled in the numeric columns only, rather than running `replace` over every cell of the merged frame (including the text and geometry columns). Reading Excel is also slow, so you can keep a binary columnar copy (parquet) of the parsed sheet, and read that copy next time unless the Excel file has changed since:
+# 
+# ```python
+# excelFile = '/Users/kaushikramganapathy/Downloads/GlobalIndexResults_NEW.xlsx'
+# cacheFile = excelFile.replace('.xlsx', '.parquet')
+# if os.path.exists(cacheFile) and os.path.getmtime(cacheFile) >= os.path.getmtime(excelFile):
+#     country_data = pd.read_parquet(cacheFile)
+# else:
+#     country_data = pd.read_excel(excelFile, header=1)
+#     try:
+#         country_data.to_parquet(cacheFile)
+#     except (ImportError, ValueError, TypeError):
+#         # pyarrow is not installed, or a column mixes numbers with text placeholders: just skip the cache
+#         pass
+# 
+# merged_df = pd.merge(world, country_data, left_on='iso_a3', right_on='id', how='inner', indicator=True)
+# num_cols = merged_df.select_dtypes('number').columns
+# merged_df[num_cols] = merged_df[num_cols].fillna(0)
+# ```
+
 # DISSOLVE is another very common operaiton when creating maps by areal units. Often, neighboring units have the same value, and the boundary between them is not needed. This is when you use DISSOLVE to aggregate such neighboring geometries with the same value. DISSOLVE removes interior boundaries of a set of polygons with the same attribute value and creates one new combined polygon.
 
 # In[51]:
@@ -410,6 +468,9 @@ sub_regions = merged_df[cols].dissolve(by='UN sub-region name', aggfunc = 'sum',
 sub_regions.plot(figsize=(20,20), column = 'UN sub-region name')
 
 # aggfunc specifies how to compute attributes for the resultant polygons (first; last; min; max; sum; mean; median)
+# attributes are aggregated with a pandas groupby, and the polygons of each group are merged 
+# with a single unary_union (a balanced, "cascaded" union) - so selecting only the needed columns first 
+# keeps both steps fast
 
 # Which non-spatial function is it similar to?
 
@@ -479,12 +540,25 @@ sm._A = []
 cbar = fig.colorbar(sm, orientation='horizontal')
 
 
+# Each `merged_df.plot(...)` call above builds all the country polygons again, even when only the style changes. Instead, you can draw the base layer once, and then restyle the polygons that are already on the map - geopandas puts them into a single matplotlib collection:
+# 
+# ```python
+# world2 = merged_df.plot(column = 'UN sub-region name', legend=True, figsize=(20,20))
+# countries = world2.collections[0]
+# countries.set_alpha(0.2)
+# countries.set_edgecolor('0.7')
+# countries.set_linewidth(3)
+# cities.plot(ax=world2, marker='*', color='black', markersize=8);
+# world2.set_axis_off()
+# ```
+
 # Now, let's create a proportional symbol map overlaid over a choropleth map. First, we need to define point locations to which we will attach country data. we'll use the same lowres world map, and create centroids for each country
 
 # In[57]:
 
 
-rep_points = geopandas.read_file(geopandas.datasets.get_path('naturalearth_lowres'))
+# we already loaded this layer into 'world' - copying it is much faster than reading the file again
+rep_points = world.copy()
 rep_points = rep_points[(rep_points.pop_est>0) & (rep_points.name!= 'Antarctica')]
 
 rep_points['centroid'] = rep_points.centroid
@@ -539,7 +613,8 @@ rep_points.head()
 # We can either use a new layer (eg cities, as below), 
 # or transform the world geodataframe from polygons into points - as in the next cell
 
-cities = geopandas.read_file(geopandas.datasets.get_path('naturalearth_cities'))
+# (cities was loaded earlier, so we don't need to read it again)
+cities.head()
 
 
 # In[62]:
@@ -563,6 +638,19 @@ pjson = rep_points.to_json()
 rps = folium.features.GeoJson(pjson)
 map1.add_child(rps)
 
+# to_json builds the whole GeoJSON document as one string in memory, and folium then copies it into the page.
+# For large layers, write the features to a file instead (GDAL writes them one by one; rounding 
+# coordinates makes the file much smaller), and let the map load the file rather than embedding it:
+#
+# rep_points.to_file('rep_points.geojson', driver='GeoJSON', COORDINATE_PRECISION=4)
+# rps = folium.features.GeoJson('rep_points.geojson', embed=False)
+# map1.add_child(rps)
+# map1.save('map.html')
+#
+# The browser then loads rep_points.geojson relative to the page, so this works for a saved map that is
+# served from the same place as the GeoJSON file (eg map.html next to it) - but not inside the notebook, 
+# where the map is shown in an embedded frame that has no address to load the file from.
+
 
 map1
 
@@ -579,12 +667,17 @@ from folium.plugins import MarkerCluster
 
 # same, using MarkerCluster
 map1 = folium.Map(location=[0, 0], zoom_start=2, tiles="cartodbpositron")
-locations = []
-for idx, row in cities.iterrows():
-    locations.append([row['geometry'].y, row['geometry'].x])
+# folium expects [latitude, longitude] pairs. Take y and x of all points at once, 
+# instead of looping over the rows with iterrows (which is very slow on large layers)
+locations = np.column_stack([cities.geometry.y, cities.geometry.x]).tolist()
     
 map1.add_child(MarkerCluster(locations=locations))
 
+# for many thousands of points, FastMarkerCluster is a lighter alternative: 
+# it sends only the coordinates to the browser, without a separate marker object for each point
+# from folium.plugins import FastMarkerCluster
+# map1.add_child(FastMarkerCluster(locations))
+
 
 # In[71]:
 
@@ -602,10 +695,16 @@ map1 = folium.Map(location=[0, 0], zoom_start=2, tiles="cartodbpositron")
 # You can convert to json (eg wjson = world.to_json() ) and explore it to make sure that the key_on is set correctly.
 # Because internally it uses GeoJson class
 
+# The page will contain every vertex of geo_data, and every column of it as feature properties.
+# At this zoom level a much coarser outline looks the same, so keep only the columns the map needs,
+# and simplify the polygons (the tolerance is in the units of the layer, here degrees)
+world_web = world[['name','gdp_per_cap','geometry']].copy()
+world_web['geometry'] = world_web.simplify(0.1)
+
 
 folium.Choropleth(
-    geo_data=world,
-    data=world,
+    geo_data=world_web,
+    data=world_web,
     columns=['name','gdp_per_cap'],
     key_on='feature.properties.name',
     fill_color='YlGn',
@@ -15,11 +15,17 @@ get_ipython().run_line_magic('matplotlib', 'inline')
 import geopandas # to be able to work with map data
 import pandas as pd
 
+# the spatial index queries later in this notebook (sindex.query_bulk, sjoin_nearest)
+# need pygeos (or shapely 2.0). Uncomment and run if needed:
+# !pip install --user pygeos
+
 import os
 current_dir = os.getcwd()
 print(current_dir)
 
 
+# **Before you run this notebook:** spatial joins and spatial index queries (`sjoin`, `sindex.query_bulk`, `sjoin_nearest`) need a spatial index library. `sjoin` and `query_bulk` work with either `rtree` or `pygeos`; `sjoin_nearest` needs `pygeos` (or shapely 2.0). Without them, these cells stop with `ImportError: Spatial indexes require either rtree or pygeos` - this is what you see in the saved output of the `sjoin` cell in section 3. Install `pygeos` (eg `conda install -c conda-forge pygeos`, or uncomment the `pip` line above) and restart the kernel.
+
 # ## 1. Let's explore several real datasets
 # 
 # There are lots of spatial data available online, from federal, state and local agencies,  from companies, university projects, and idividual enthusiasts.
@@ -48,7 +54,29 @@ print(current_dir)
 # and PLOT (to create a map):
 
 shpFileIn = '/Users/kaushikramganapathy/DSC-170/PARKS/PARKS.shp'
-sd_parks = geopandas.read_file(shpFileIn)
+
+# parsing a shapefile is slow. We keep a copy of the layer in a binary columnar format (GeoParquet),
+# and read that copy instead - unless the shapefile has changed since the copy was made.
+# Since each column is stored separately, we can read only the columns we need: the other columns
+# are never loaded from disk. (The geometries we do read are still decoded into new shapely objects.)
+# A shapefile is really a set of files (.shp, .shx, .dbf with the attributes, .prj, ...), so the copy
+# is up to date only if it is newer than all of them.
+import glob
+
+def read_cached(shpFile, columns=None):
+    cacheFile = shpFile.replace('.shp', '.parquet')
+    shpFiles = [f for f in glob.glob(shpFile[:-len('.shp')] + '.*') if f != cacheFile]
+    if os.path.exists(cacheFile) and os.path.getmtime(cacheFile) >= max(map(os.path.getmtime, shpFiles)):
+        return geopandas.read_parquet(cacheFile, columns=columns)
+    gdf = geopandas.read_file(shpFile)
+    try:
+        gdf.to_parquet(cacheFile)
+    except ImportError:
+        # GeoParquet needs pyarrow, which is not installed everywhere: then just skip the cache
+        pass
+    return gdf if columns is None else gdf[columns]
+
+sd_parks = read_cached(shpFileIn)
 sd_parks.info
 
 
@@ -64,7 +92,8 @@ sd_parks.info
 # showing a single park by name
 cols = ['geometry','NAME','OWNERSHIP']
 
-a = sd_parks[cols]
+# same as sd_parks[cols], but only these three columns are read from the cached copy
+a = read_cached(shpFileIn, columns=cols)
 a[a['NAME'] == 'All Seasons Park']
 
 
@@ -96,6 +125,23 @@ sd_parks_dissolved = sd_parks[cols].dissolve(by='NAME', aggfunc = 'first', as_in
 sd_parks_dissolved.plot(figsize=(20,20), column = 'NAME')
 
 
+# In[ ]:
+
+
+# What does DISSOLVE do under the hood? It is a pandas groupby over the attribute columns, 
+# plus a union of the geometries within each group. unary_union merges all polygons of a group 
+# at once, as a balanced tree (a "cascaded union") - which is much faster than adding polygons 
+# one by one with .union() in a loop. So, for large layers:
+#   - keep only the columns you need before dissolving (as we did with cols)
+#   - aggregate attributes with the built-in names ('first', 'sum', ...) rather than custom python functions
+
+grouped = sd_parks[cols].groupby('NAME')
+parks_by_name = geopandas.GeoDataFrame(grouped['OWNERSHIP'].first(),
+                                       geometry=grouped['geometry'].agg(lambda parts: parts.unary_union),
+                                       crs=sd_parks.crs)
+parks_by_name.head()
+
+
 # In[10]:
 
 
@@ -114,6 +160,27 @@ sd_parks_dissolved.geom_type
 sd_parks.plot(figsize=(10,10), column = 'OWNERSHIP', legend = True)
 
 
+# In[ ]:
+
+
+# At figsize=(10,10) the map is only about 10 inches x 72 dpi = 720 pixels wide. Vertices that are 
+# less than a pixel apart can't be seen on such a map - but matplotlib still has to draw every one of them.
+# So for plotting we can simplify the polygons, with a tolerance of about one pixel in map units.
+# preserve_topology=True makes sure that simplified polygons stay valid.
+# We keep each simplified version, so plotting again at the same size reuses it.
+
+parks_simplified = {}
+
+def parks_for_plot(figsize=(10,10), dpi=72):
+    minx, miny, maxx, maxy = sd_parks.total_bounds
+    tolerance = max((maxx - minx) / (figsize[0] * dpi), (maxy - miny) / (figsize[1] * dpi))
+    if tolerance not in parks_simplified:
+        parks_simplified[tolerance] = sd_parks.assign(geometry=sd_parks.simplify(tolerance, preserve_topology=True))
+    return parks_simplified[tolerance]
+
+parks_for_plot(figsize=(10,10)).plot(figsize=(10,10), column = 'OWNERSHIP', legend = True)
+
+
 # In[13]:
 
 
@@ -122,7 +189,7 @@ sd_parks.plot(figsize=(10,10), column = 'OWNERSHIP', legend = True)
 
 shpFileIn = '/Users/kaushikramganapathy/Downloads/california_coastline/california_coastline.shp'
 
-ca_water = geopandas.read_file(shpFileIn)
+ca_water = read_cached(shpFileIn)
 ca_water.info
 
 
@@ -138,8 +205,8 @@ ca_water.count()
 # In[16]:
 
 
-shpFileIn = '/Users/kaushikramganapathy/Downloads/california_coastline/california_coastline.shp'
-ca_coastline = geopandas.read_file(shpFileIn)
+# this is the same file we loaded into ca_water - no need to read it again, just copy it
+ca_coastline = ca_water.copy()
 ca_coastline.info
 
 
@@ -277,10 +344,10 @@ print(world.crs)
 world_m = world.to_crs('epsg:3395')
 world_m.plot()
 
-world_m = world.to_crs("+proj=eck4 +lon_0=0 +x_0=0 +y_0=0 +ellps=WGS84 +datum=WGS84 +units=m no_defs")
+world_m = world.to_crs("+proj=eck4 +lon_0=0 +x_0=0 +y_0=0 +ellps=WGS84 +datum=WGS84 +units=m +no_defs")
 world_m.plot() #Eckert IV (copied from https://epsg.io/54012)
 
-world_m = world.to_crs(" +proj=moll +lon_0=0 +x_0=0 +y_0=0 +ellps=WGS84 +datum=WGS84 +units=m no_defs")
+world_m = world.to_crs(" +proj=moll +lon_0=0 +x_0=0 +y_0=0 +ellps=WGS84 +datum=WGS84 +units=m +no_defs")
 world_m.plot() #Mollweide (copied from https://epsg.io/54009)
 
 
@@ -350,6 +417,8 @@ print(sd_parks2.area[0]) # compare with:
 print(sd_parks.area[0])
 
 
+# Note that each of `sd_parks2.geom_type[0]`, `sd_parks2.centroid[0]`, `sd_parks2.representative_point()[0]` and `sd_parks2.area[0]` above computes the measure for *all* parks, and then keeps only the first value. When you need a measure for a single park, ask its geometry directly, eg `sd_parks2.geometry[0].centroid` or `sd_parks2.geometry[0].area`. And when you need a measure for all parks more than once, compute it once and keep the result (eg `park_centroids = sd_parks2.centroid`) rather than calling `.centroid` again.
+
 # ### Computing distance between spatial objects, and exploring spatial relationships
 # 
 # There are two options when computing distance (or other relationships): 
@@ -366,16 +435,35 @@ print(sd_parks.area[0])
 # let's figure out the ID of Lake Hodges, then compute distances from first 5 parks to this lake
 print(ca_water[ca_water['NAME'] == 'Lake Hodges'])
 
+# the format is: gdf1.distance(object_in_gdf2). It returns distances for ALL parks at once,
+# so compute it one time, outside of the loop, and then just pick the values you need
+
+dist_to_lake = sd_parks2.distance(ca_water.loc[7108,'geometry'])
+
 for i in range(3):
-    
-#     the format is: gdf1.distance(object_in_gdf2)
-    
-    print(sd_parks2.distance(ca_water.loc[7108,'geometry'])[i], sd_parks2.loc[i,'NAME'])
+    print(dist_to_lake[i], sd_parks2.loc[i,'NAME'])
     
     
 #      Question: What are the units of distance here??
 
 
+# In[ ]:
+
+
+# what if we need the distance from every park to its closest water body, not just to Lake Hodges?
+# Computing all park x water distances would be very slow. sjoin_nearest uses the spatial index 
+# of ca_water to only compare each park with a few nearby candidates.
+# Distances should be measured in a projected CRS: we use the original parks layer (sd_parks, in
+# California zone 6, epsg:2230, where units are feet), and reproject the water bodies to it.
+# max_distance only looks for water bodies within 1 mile (5280 feet); with how='left' the parks
+# that have no water body that close are kept, with NaN in the water NAME and distance columns.
+
+water_2230 = ca_water[['NAME','geometry']].to_crs(sd_parks.crs)
+parks_to_water = geopandas.sjoin_nearest(sd_parks[['NAME','geometry']], water_2230, 
+                                         how='left', max_distance=5280, distance_col='distance')
+parks_to_water.head()
+
+
 # In[35]:
 
 
@@ -501,6 +589,28 @@ map1 = sd_parks_buffer.plot(color='red')
 sd_parks2.plot(ax=map1)
 
 
+# In[ ]:
+
+
+# Note that .03 is in degrees, since sd_parks2 is in epsg:4326 - and a degree of longitude is a shorter
+# distance than a degree of latitude. To buffer by a distance in meters, use a projected CRS, 
+# eg UTM zone 11N (epsg:26911). resolution sets the number of segments used for a quarter circle 
+# (default is 16): fewer segments make buffering faster, and the result coarser.
+sd_parks_utm = sd_parks2[['NAME','geometry']].to_crs('epsg:26911')
+sd_parks_buffer_500m = sd_parks_utm.buffer(500, resolution=4)
+# compare with the .03 degree buffers above
+map2 = sd_parks_buffer_500m.plot(color='red')
+sd_parks_utm.plot(ax=map2)
+
+# If the question is just "which water bodies are within 500 m of a park", we don't even need the buffers:
+# sjoin_nearest uses a spatial index to find the closest park for each water body, 
+# and max_distance keeps only the pairs that are closer than 500 m
+water_utm = ca_water[['NAME','geometry']].to_crs('epsg:26911')
+water_near_parks = geopandas.sjoin_nearest(water_utm, sd_parks_utm, how='inner', 
+                                           max_distance=500, distance_col='distance')
+water_near_parks.head()
+
+
 # ## 3. Constructing a Geopandas geodataframe
 # 
 # In most cases, you will be reading spatial data files from other sources. But sometimes you need to create a data frame with points of interest from scratch - for example when you need to do some distance-based operations relative to these points. There are several ways to do this.
@@ -641,7 +751,22 @@ sd_parks2.count()
 # You need to have valid geometries to do spatial join.
 # https://stackoverflow.com/questions/56961270/geopandas-spatial-join-attributeerror-nonetype-object-has-no-attribute-bou
 
-sd_parks2_clean = sd_parks2.loc[sd_parks2.is_valid]
+# Simply dropping invalid geometries would silently lose some parks. Instead, we repair them: 
+# make_valid rebuilds an invalid polygon (eg one whose boundary crosses itself) as a valid one, 
+# keeping all of its area (buffer(0), which you may see suggested, can drop parts of such polygons).
+# is_valid is computed once, and only the invalid geometries are repaired.
+# Note that is_valid is also False for missing geometries, so we don't count these as invalid.
+from shapely.validation import make_valid
+
+valid = sd_parks2.is_valid
+invalid = ~valid & sd_parks2.geometry.notna()
+print(invalid.sum(), 'invalid park geometries')
+
+sd_parks2_clean = sd_parks2.copy()
+sd_parks2_clean.loc[invalid, 'geometry'] = sd_parks2.loc[invalid].geometry.apply(make_valid)
+
+# parks that have no geometry at all can't be repaired, so these are the only ones we drop
+sd_parks2_clean = sd_parks2_clean.loc[sd_parks2_clean.geometry.notna()]
 new_locations_clean = new_locations.loc[new_locations.is_valid]
 
 
@@ -691,3 +816,45 @@ sdp.plot(column='NAME',legend=True,figsize=(10,10))
 
 
 # Apparently, as we saw earlier with two other parks, park geometries are not necessarily tied to each other. We'll explore this in the next topic.
+
+# ### Querying the spatial index directly
+
+# In[ ]:
+
+
+# sjoin returns a whole new geodataframe, with the columns of both inputs. If you only need to know 
+# which point falls into which park, you can query a spatial index directly.
+# A geodataframe builds its spatial index (sindex, an STRtree) the first time it is used, and then keeps it.
+# For 'within', sjoin indexes the left frame (the points) and queries it with the parks - so every new
+# batch of points gets a new index. Here the parks index is built once, and reused for every batch of points.
+# query_bulk compares bounding boxes first, and runs the exact "within" test only for the candidate pairs.
+
+parks_index = sd_parks2_clean.sindex
+point_idx, park_idx = parks_index.query_bulk(new_locations_clean.geometry, predicate='within')
+
+# the result is two arrays of positions: point_idx[k] is within park_idx[k]
+print(new_locations_clean.iloc[point_idx]['Proposed Coffee Shop'].values)
+print(sd_parks2_clean.iloc[park_idx]['NAME'].values)
+
+
+# In[ ]:
+
+
+# Earlier, we used shift() to compare each park only with the next row. To find ALL pairs of adjacent parks, 
+# comparing every park with every other park would take n*n checks. The spatial index first finds the pairs 
+# whose bounding boxes overlap, and checks "touches" only for those pairs.
+# Predicates like "touches" can fail or give wrong answers on invalid polygons, so we use the repaired
+# parks (sd_parks2_clean), and the index we already built for them:
+import numpy as np
+from scipy.sparse import csr_matrix
+
+park_i, park_j = parks_index.query_bulk(sd_parks2_clean.geometry, predicate='touches')
+
+# store the result as a sparse adjacency matrix: row i has 1s in the columns of the parks that touch park i
+n = len(sd_parks2_clean)
+adjacency = csr_matrix((np.ones(len(park_i)), (park_i, park_j)), shape=(n, n))
+print(adjacency.nnz // 2, 'pairs of touching parks')
+
+# (the libpysal package builds such "spatial weights" too, eg libpysal.weights.Queen.from_dataframe(sd_parks2_clean))
+
+